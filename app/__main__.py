@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 """Entry point for running Hass-MCP as a module"""
 
-from app.server import mcp
+from app.server import mcp, setup_logging
 
 
 def main():
     """Run the MCP server with stdio communication"""
+    setup_logging()
     mcp.run()
 
 
@@ -1,18 +1,28 @@
+import functools
 import os
-from typing import Optional
+from types import MappingProxyType
+from typing import Mapping, Optional
 
 # Home Assistant configuration
 HA_URL: str = os.environ.get("HA_URL", "http://localhost:8123")
 HA_TOKEN: str = os.environ.get("HA_TOKEN", "")
 
-def get_ha_headers() -> dict:
-    """Return the headers needed for Home Assistant API requests"""
+@functools.lru_cache(maxsize=1)
+def _build_ha_headers(token: str) -> Mapping[str, str]:
+    """Build the (read-only) header mapping for a given token"""
     headers = {
         "Content-Type": "application/json",
     }
     
     # Only add Authorization header if token is provided
-    if HA_TOKEN:
-        headers["Authorization"] = f"Bearer {HA_TOKEN}"
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
     
-    return headers
+    return MappingProxyType(headers)
+
+def get_ha_headers() -> Mapping[str, str]:
+    """Return the headers needed for Home Assistant API requests
+    
+    The mapping is built once per token and shared, so it is read-only.
+    """
+    return _build_ha_headers(HA_TOKEN)
@@ -1,18 +1,19 @@
 import httpx
-from typing import Dict, Any, Optional, List, TypeVar, Callable, Awaitable, Union, cast
+import orjson
+from typing import Dict, Any, Optional, List, TypeVar, Callable, Awaitable, Union, Tuple, cast
+import asyncio
 import functools
+from collections import Counter, defaultdict
 import inspect
 import logging
-import json
 import os
+import re
 
 from app.config import HA_URL, HA_TOKEN, get_ha_headers
 
 # Type variable for generic functions
 F = TypeVar('F', bound=Callable[..., Any])
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Define a generic type for our API function return values
@@ -21,6 +22,14 @@ T = TypeVar('T')
 # HTTP client
 _client: Optional[httpx.AsyncClient] = None
 
+# Connection pool and timeouts for the shared client. MCP clients often fire
+# many tool calls in parallel; httpx' default pool (10 keep-alive connections)
+# would drop and re-open connections under such bursts. The timeout stays at
+# 10 s for every phase, so requests queue for a pool slot during a burst and
+# slow (remote or proxied) connections are not cut off.
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+HTTP_TIMEOUTS = httpx.Timeout(10.0)
+
 # Default field sets for different verbosity levels
 # Lean fields for standard requests (optimized for token efficiency)
 DEFAULT_LEAN_FIELDS = ["entity_id", "state", "attr.friendly_name"]
@@ -44,9 +53,13 @@ DOMAIN_IMPORTANT_ATTRIBUTES = {
 class SimpleCache:
     """Einfaches In-Memory-Cache-System für API-Anfragen"""
     
-    def __init__(self, ttl_seconds: int = 30):
+    def __init__(self, ttl_seconds: int = 30, max_entries: Optional[int] = None):
         self.cache = {}
         self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Wird bei jeder Invalidierung erhöht, damit laufende Anfragen
+        # von davor keine veralteten Werte mehr eintragen
+        self.generation = 0
         
     def get(self, key: str) -> Optional[Any]:
         """Versuche, einen Wert aus dem Cache zu holen"""
@@ -70,10 +83,16 @@ class SimpleCache:
         """Speichere einen Wert im Cache"""
         import time
         
+        # Neu einfügen, damit der Eintrag ans Ende der Einfügereihenfolge rückt
+        self.cache.pop(key, None)
+        if self.max_entries is not None and len(self.cache) >= self.max_entries:
+            # Ältesten Eintrag verwerfen
+            del self.cache[next(iter(self.cache))]
         self.cache[key] = (time.time(), value)
         
     def invalidate(self, key_prefix: str = None) -> None:
         """Invalidiere Cache-Einträge basierend auf einem Präfix"""
+        self.generation += 1
         if key_prefix is None:
             # Lösche den gesamten Cache
             self.cache.clear()
@@ -100,8 +119,15 @@ def make_cache_key(base_key: str, *args, **kwargs) -> str:
 
 # Dekorator für cachable Funktionen
 def cacheable(cache_instance, key_prefix: str, use_cache: bool = True):
-    """Dekorator zum Cachen von Funktionsaufrufen"""
+    """Dekorator zum Cachen von Funktionsaufrufen
+    
+    Gleichzeitige Cache-Misses für denselben Schlüssel teilen sich einen
+    einzigen Aufruf (Single-Flight), statt jeweils eine eigene Anfrage zu starten.
+    """
     def decorator(func):
+        # Laufende Aufrufe pro Cache-Schlüssel, mit der Cache-Generation beim Start
+        inflight: Dict[str, Tuple[int, asyncio.Task]] = {}
+        
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
             # Extrahiere den cache-Parameter, wenn vorhanden, sonst Standard
@@ -117,17 +143,43 @@ def cacheable(cache_instance, key_prefix: str, use_cache: bool = True):
             # Versuche, aus dem Cache zu holen
             cached_result = cache_instance.get(cache_key)
             if cached_result is not None:
-                logger.debug(f"Cache hit for {func.__name__} - {cache_key}")
+                logger.debug("Cache hit for %s - %s", func.__name__, cache_key)
                 return cached_result
             
-            # Cache-Miss, rufe die Funktion auf
-            logger.debug(f"Cache miss for {func.__name__} - {cache_key}")
+            # Läuft bereits ein Aufruf für diesen Schlüssel, auf dessen Ergebnis warten.
+            # Aufrufe, die vor einer Invalidierung gestartet wurden, nicht mehr teilen:
+            # sie können den Zustand vor der Änderung liefern.
+            generation = cache_instance.generation
+            entry = inflight.get(cache_key)
+            if entry is None or entry[0] != generation:
+                # Cache-Miss, rufe die Funktion auf
+                logger.debug("Cache miss for %s - %s", func.__name__, cache_key)
+                task = asyncio.ensure_future(_call_and_store(cache_key, generation, *args, **kwargs))
+                inflight[cache_key] = (generation, task)
+                task.add_done_callback(functools.partial(_forget, cache_key))
+            else:
+                task = entry[1]
+                logger.debug("Joining in-flight call for %s - %s", func.__name__, cache_key)
+            
+            # shield: ein abgebrochener Aufrufer bricht nicht die Anfrage der anderen ab
+            return await asyncio.shield(task)
+        
+        def _forget(cache_key, task):
+            # Nur entfernen, wenn der Eintrag nicht schon durch einen neueren Aufruf ersetzt wurde
+            entry = inflight.get(cache_key)
+            if entry is not None and entry[1] is task:
+                del inflight[cache_key]
+        
+        async def _call_and_store(cache_key, generation, *args, **kwargs):
             result = await func(*args, **kwargs)
             
             # Speichere das Ergebnis im Cache, außer bei Fehlern
             if isinstance(result, dict) and result.get('error'):
                 # Fehler nicht cachen
-                logger.debug(f"Not caching error result for {func.__name__}")
+                logger.debug("Not caching error result for %s", func.__name__)
+            elif cache_instance.generation != generation:
+                # Cache wurde während des Aufrufs invalidiert, Ergebnis ist evtl. veraltet
+                logger.debug("Not caching stale result for %s", func.__name__)
             else:
                 cache_instance.set(cache_key, result)
             
@@ -183,11 +235,22 @@ def handle_api_errors(func: F) -> F:
 
 # Persistent HTTP client
 async def get_client() -> httpx.AsyncClient:
-    """Get a persistent httpx client for Home Assistant API calls"""
+    """
+    Get a persistent httpx client for Home Assistant API calls
+    
+    The client carries the Home Assistant headers, so requests made with it
+    don't need to pass headers themselves. HTTP/2 is negotiated when Home
+    Assistant is served over TLS. Close it with cleanup_client() on shutdown.
+    """
     global _client
     if _client is None:
         logger.debug("Creating new HTTP client")
-        _client = httpx.AsyncClient(timeout=10.0)
+        _client = httpx.AsyncClient(
+            limits=HTTP_LIMITS,
+            timeout=HTTP_TIMEOUTS,
+            http2=True,
+            headers=get_ha_headers()
+        )
     return _client
 
 async def cleanup_client() -> None:
@@ -195,16 +258,37 @@ async def cleanup_client() -> None:
     global _client
     if _client:
         logger.debug("Closing HTTP client")
-        await _client.aclose()
-        _client = None
+        # Reset first, so callers during aclose() already get a new client
+        client, _client = _client, None
+        await client.aclose()
+
+def get_http_error_message(response: httpx.Response) -> str:
+    """
+    Extract the error message from a Home Assistant error response
+    
+    The body is parsed once with orjson; if it is not JSON (or has no
+    "message" field) the raw body text is returned instead. An empty body
+    yields an empty string.
+    """
+    raw = response.content
+    if not raw:
+        # Nothing to parse or decode
+        return ""
+    try:
+        error_response = orjson.loads(raw)
+        if isinstance(error_response, dict) and error_response.get("message"):
+            return error_response["message"]
+    except orjson.JSONDecodeError:
+        pass
+    return raw.decode("utf-8", "replace")
 
 # Direct entity retrieval function
 async def get_all_entity_states() -> Dict[str, Dict[str, Any]]:
     """Fetch all entity states from Home Assistant"""
     client = await get_client()
-    response = await client.get(f"{HA_URL}/api/states", headers=get_ha_headers())
+    response = await client.get(f"{HA_URL}/api/states")
     response.raise_for_status()
-    entities = response.json()
+    entities = orjson.loads(response.content)
     
     # Create a mapping for easier access
     return {entity["entity_id"]: entity for entity in entities}
@@ -259,9 +343,9 @@ def filter_fields(data: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
 async def get_hass_version() -> str:
     """Get the Home Assistant version from the API"""
     client = await get_client()
-    response = await client.get(f"{HA_URL}/api/config", headers=get_ha_headers())
+    response = await client.get(f"{HA_URL}/api/config")
     response.raise_for_status()
-    data = response.json()
+    data = orjson.loads(response.content)
     return data.get("version", "unknown")
 
 @handle_api_errors
@@ -287,12 +371,9 @@ async def get_entity_state(
     """
     # Fetch directly
     client = await get_client()
-    response = await client.get(
-        f"{HA_URL}/api/states/{entity_id}", 
-        headers=get_ha_headers()
-    )
+    response = await client.get(f"{HA_URL}/api/states/{entity_id}")
     response.raise_for_status()
-    entity_data = response.json()
+    entity_data = orjson.loads(response.content)
     
     # Apply field filtering if requested
     if fields:
@@ -340,9 +421,9 @@ async def get_entities(
     """
     # Get all entities directly
     client = await get_client()
-    response = await client.get(f"{HA_URL}/api/states", headers=get_ha_headers())
+    response = await client.get(f"{HA_URL}/api/states")
     response.raise_for_status()
-    entities = response.json()
+    entities = orjson.loads(response.content)
     
     # Filter by domain if specified
     if domain:
@@ -429,17 +510,15 @@ async def call_service(domain: str, service: str, data: Optional[Dict[str, Any]]
     try:
         response = await client.post(
             f"{HA_URL}/api/services/{domain}/{service}", 
-            headers=get_ha_headers(),
-            json=data
+            content=orjson.dumps(data)  # Content-Type is set on the shared client
         )
         response.raise_for_status()
         
         # Invalidate cache after service calls as they might change entity states
-        global _entities_timestamp
-        _entities_timestamp = 0
+        entity_cache.invalidate()
         
         try:
-            return response.json()
+            return orjson.loads(response.content)
         except ValueError:
             # Return success if response is empty but status was 200
             if response.status_code == 200:
@@ -455,13 +534,8 @@ async def call_service(domain: str, service: str, data: Optional[Dict[str, Any]]
                 }
     except httpx.HTTPStatusError as e:
         # Handle HTTP errors with more details
-        error_detail = ""
-        try:
-            error_response = e.response.json()
-            if isinstance(error_response, dict) and "message" in error_response:
-                error_detail = f": {error_response['message']}"
-        except:
-            error_detail = f": {e.response.text}" if e.response.text else ""
+        message = get_http_error_message(e.response)
+        error_detail = f": {message}" if message else ""
             
         return {
             "error": f"HTTP error {e.response.status_code}{error_detail}",
@@ -489,47 +563,35 @@ async def summarize_domain(domain: str, example_limit: int = 3) -> Dict[str, Any
         return entities  # Just pass through the error
     
     try:
-        # Initialize summary data
-        total_count = len(entities)
-        state_counts = {}
-        state_examples = {}
-        attributes_summary = {}
+        # Single pass over the entities: count states and attribute keys,
+        # and collect up to example_limit examples per state
+        state_counts: Counter = Counter()
+        state_examples: defaultdict = defaultdict(list)
+        attributes_summary: Counter = Counter()
         
-        # Process entities to build the summary
         for entity in entities:
             state = entity.get("state", "unknown")
-            
-            # Count states
-            if state not in state_counts:
-                state_counts[state] = 0
-                state_examples[state] = []
+            attributes = entity.get("attributes", {})
             state_counts[state] += 1
             
             # Add examples (up to the limit)
-            if len(state_examples[state]) < example_limit:
-                example = {
+            examples = state_examples[state]
+            if len(examples) < example_limit:
+                examples.append({
                     "entity_id": entity["entity_id"],
-                    "friendly_name": entity.get("attributes", {}).get("friendly_name", entity["entity_id"])
-                }
-                state_examples[state].append(example)
+                    "friendly_name": attributes.get("friendly_name", entity["entity_id"])
+                })
             
             # Collect attribute keys for summary
-            for attr_key in entity.get("attributes", {}):
-                if attr_key not in attributes_summary:
-                    attributes_summary[attr_key] = 0
-                attributes_summary[attr_key] += 1
+            attributes_summary.update(attributes.keys())
         
         # Create the summary
         summary = {
             "domain": domain,
-            "total_count": total_count,
-            "state_distribution": state_counts,
-            "examples": state_examples,
-            "common_attributes": sorted(
-                [(k, v) for k, v in attributes_summary.items()], 
-                key=lambda x: x[1], 
-                reverse=True
-            )[:10]  # Top 10 most common attributes
+            "total_count": len(entities),
+            "state_distribution": dict(state_counts),
+            "examples": dict(state_examples),
+            "common_attributes": attributes_summary.most_common(10)  # Top 10 most common attributes
         }
         
         return summary
@@ -579,6 +641,33 @@ async def restart_home_assistant() -> Dict[str, Any]:
     """Restart Home Assistant"""
     return await call_service("homeassistant", "restart", {})
 
+def _analyze_error_log(log_text: str) -> Dict[str, Any]:
+    """
+    Count errors, warnings and integration mentions in the error log text
+
+    Synchronous on purpose so it can run in an executor thread.
+    """
+    # Count errors and warnings
+    error_count = log_text.count("ERROR")
+    warning_count = log_text.count("WARNING")
+    
+    # Extract integration mentions
+    integration_mentions = {}
+    
+    # Look for patterns like [mqtt], [zwave], etc.
+    for match in re.finditer(r'\[([a-zA-Z0-9_]+)\]', log_text):
+        integration = match.group(1).lower()
+        if integration not in integration_mentions:
+            integration_mentions[integration] = 0
+        integration_mentions[integration] += 1
+    
+    return {
+        "log_text": log_text,
+        "error_count": error_count,
+        "warning_count": warning_count,
+        "integration_mentions": integration_mentions
+    }
+
 @handle_api_errors
 async def get_hass_error_log() -> Dict[str, Any]:
     """
@@ -595,46 +684,26 @@ async def get_hass_error_log() -> Dict[str, Any]:
     try:
         # Call the Home Assistant API error_log endpoint
         url = f"{HA_URL}/api/error_log"
-        headers = get_ha_headers()
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                log_text = response.text
-                
-                # Count errors and warnings
-                error_count = log_text.count("ERROR")
-                warning_count = log_text.count("WARNING")
-                
-                # Extract integration mentions
-                import re
-                integration_mentions = {}
-                
-                # Look for patterns like [mqtt], [zwave], etc.
-                for match in re.finditer(r'\[([a-zA-Z0-9_]+)\]', log_text):
-                    integration = match.group(1).lower()
-                    if integration not in integration_mentions:
-                        integration_mentions[integration] = 0
-                    integration_mentions[integration] += 1
-                
-                return {
-                    "log_text": log_text,
-                    "error_count": error_count,
-                    "warning_count": warning_count,
-                    "integration_mentions": integration_mentions
-                }
-            else:
-                return {
-                    "error": f"Error retrieving error log: {response.status_code} {response.reason_phrase}",
-                    "details": response.text,
-                    "log_text": "",
-                    "error_count": 0,
-                    "warning_count": 0,
-                    "integration_mentions": {}
-                }
+        # Reuse the pooled client instead of opening a new connection per call
+        client = await get_client()
+        response = await client.get(url, timeout=30)
+        
+        if response.status_code == 200:
+            # Parsing a large log is pure CPU work, keep it off the event loop
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, _analyze_error_log, response.text)
+        else:
+            return {
+                "error": f"Error retrieving error log: {response.status_code} {response.reason_phrase}",
+                "details": response.text,
+                "log_text": "",
+                "error_count": 0,
+                "warning_count": 0,
+                "integration_mentions": {}
+            }
     except Exception as e:
-        logger.error(f"Error retrieving Home Assistant error log: {str(e)}")
+        logger.error("Error retrieving Home Assistant error log: %s", e)
         return {
             "error": f"Error retrieving error log: {str(e)}",
             "log_text": "",
@@ -666,16 +735,6 @@ async def get_entity_history(entity_id: str, hours: int = 24, minimal: bool = Fa
         - statistics: Summary statistics (min, max, avg) if applicable
     """
     try:
-        # Verify the entity exists first
-        current = await get_entity_state(entity_id, detailed=True)
-        if isinstance(current, dict) and "error" in current:
-            return {
-                "entity_id": entity_id,
-                "error": current["error"],
-                "states": [],
-                "count": 0
-            }
-        
         # Calculate the start time (now - hours)
         from datetime import datetime, timedelta
         import urllib.parse
@@ -693,11 +752,52 @@ async def get_entity_history(entity_id: str, hours: int = 24, minimal: bool = Fa
         # Build URL with timestamp filter
         url = f"{HA_URL}/api/history/period/{start_time_str}?filter_entity_id={encoded_entity_id}&end_time={end_time_str}"
         
-        # Get history from API
-        client = await get_client()
-        response = await client.get(url, headers=get_ha_headers(), timeout=30)
-        response.raise_for_status()
-        history_data = response.json()
+        async def fetch_history() -> Any:
+            try:
+                client = await get_client()
+                response = await client.get(url, timeout=30)
+                response.raise_for_status()
+                return orjson.loads(response.content)
+            except Exception:
+                # Let the existence check finish before the task group cancels it:
+                # "entity not found" takes precedence over the history error
+                await asyncio.wait({current_task})
+                raise
+        
+        def entity_error() -> Optional[Dict[str, Any]]:
+            if current_task.cancelled() or current_task.exception() is not None:
+                return None
+            current = current_task.result()
+            if isinstance(current, dict) and "error" in current:
+                return {
+                    "entity_id": entity_id,
+                    "error": current["error"],
+                    "states": [],
+                    "count": 0
+                }
+            return None
+        
+        # The existence check and the history request are independent,
+        # so run both concurrently instead of paying two round trips.
+        # The TaskGroup cancels the sibling request if one of them fails;
+        # a failing history request first waits for the existence check.
+        try:
+            async with asyncio.TaskGroup() as tg:
+                current_task = tg.create_task(get_entity_state(entity_id))
+                history_task = tg.create_task(fetch_history())
+        except ExceptionGroup as eg:
+            error = entity_error()
+            if error is not None:
+                return error
+            # Report the first underlying error, not the group wrapper,
+            # but keep the others in the log and the group as the cause
+            for exc in eg.exceptions[1:]:
+                logger.debug("Further error in history request for %s: %r", entity_id, exc)
+            raise eg.exceptions[0] from eg
+        error = entity_error()
+        if error is not None:
+            return error
+        current, history_data = current_task.result(), history_task.result()
         
         # History API returns a list of lists, with each inner list containing
         # the state history for a single entity
@@ -835,7 +935,8 @@ async def get_entity_history(entity_id: str, hours: int = 24, minimal: bool = Fa
         
         return result
     except Exception as e:
-        logger.error(f"Error retrieving history for {entity_id}: {str(e)}", exc_info=True)
+        logger.error("Error retrieving history for %s: %r", entity_id, e)
+        logger.debug("Traceback for history of %s", entity_id, exc_info=True)
         return {
             "entity_id": entity_id,
             "error": f"Error retrieving history: {str(e)}",
@@ -860,9 +961,9 @@ async def get_system_overview() -> Dict[str, Any]:
         # Get ALL entities with minimal fields for efficiency
         # We retrieve all entities since API calls don't consume tokens, only responses do
         client = await get_client()
-        response = await client.get(f"{HA_URL}/api/states", headers=get_ha_headers())
+        response = await client.get(f"{HA_URL}/api/states")
         response.raise_for_status()
-        all_entities_raw = response.json()
+        all_entities_raw = orjson.loads(response.content)
         
         # Apply lean formatting to reduce token usage in the response
         all_entities = []
@@ -963,5 +1064,5 @@ async def get_system_overview() -> Dict[str, Any]:
         
         return overview
     except Exception as e:
-        logger.error(f"Error generating system overview: {str(e)}")
+        logger.error("Error generating system overview: %s", e)
         return {"error": f"Error generating system overview: {str(e)}"}
@@ -1,25 +1,49 @@
 # -*- coding: utf-8 -*-
+import atexit
 import functools
 import logging
+import logging.handlers
 import json
+import orjson
+import queue
 import httpx # Sicherstellen, dass httpx importiert ist, falls benötigt
-from typing import List, Dict, Any, Optional, Callable, Awaitable, TypeVar, cast
-import aiohttp
-import os
-
-# Logging einrichten
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler() # Loggt auf stderr, was in Claude Desktop Logs erscheint
-    ]
-)
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator, TypeVar, cast
+
 logger = logging.getLogger(__name__)
 
+def setup_logging(level: int = logging.INFO) -> None:
+    """
+    Logging für den Server-Prozess einrichten
+
+    Die Log-Aufrufe landen nur in einer Queue; ein QueueListener-Thread schreibt
+    sie auf stderr, damit das Schreiben die Event-Loop nicht blockiert.
+    Wird vom Entrypoint aufgerufen, nicht beim Import des Moduls.
+    """
+    root = logging.getLogger()
+    if any(isinstance(h, logging.handlers.QueueHandler) for h in root.handlers):
+        return  # Bereits eingerichtet
+
+    stream_handler = logging.StreamHandler() # Loggt auf stderr, was in Claude Desktop Logs erscheint
+    stream_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # FastMCP richtet beim Erzeugen per basicConfig eigene Handler ein; ersetzen
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
 # Importiere Home Assistant API-Funktionen
+from app.config import HA_URL
 from app.hass import (
-    get_hass_version, get_entity_state, call_service, get_entities,
+    get_client, entity_cache, get_hass_version, get_entity_state, call_service, get_entities,
     get_automations, restart_home_assistant,
     cleanup_client, filter_fields, summarize_domain, get_system_overview,
     get_hass_error_log, get_entity_history
@@ -27,8 +51,8 @@ from app.hass import (
 
 # Import der neuen Funktionen aus simplified_extensions
 from app.simplified_extensions import (
-    configure_ha_component, delete_ha_component,
-    set_entity_attributes
+    configure_ha_component, configure_ha_components, delete_ha_component,
+    set_entity_attributes, drain_background, flush_reloads
 )
 
 
@@ -40,9 +64,41 @@ from mcp.server.fastmcp import FastMCP, Context, Image
 from mcp.server.stdio import stdio_server
 import mcp.types as types
 
+# Anzahl offener MCP-Sessions (der Lifespan läuft einmal pro Session)
+_active_sessions = 0
+
+# Maximale Wartezeit beim Herunterfahren auf eager abgesetzte Konfigurationsaufrufe
+SHUTDOWN_DRAIN_TIMEOUT = 10.0
+
+@asynccontextmanager
+async def server_lifespan(server: FastMCP) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Gemeinsamen HTTP-Client schließen, wenn die letzte Session endet
+
+    FastMCP betritt den Lifespan für jede Session (bei SSE also pro
+    verbundenem Client). Der Client wird von allen Sessions geteilt und darf
+    daher erst geschlossen werden, wenn keine Session mehr offen ist. Vorher
+    werden laufende Hintergrund-Konfigurationen abgewartet und ausstehende
+    Reloads ausgeführt.
+    """
+    global _active_sessions
+    _active_sessions += 1
+    try:
+        yield {}
+    finally:
+        _active_sessions -= 1
+        if _active_sessions == 0:
+            # Eager-Anfragen abschließen (sie planen ggf. selbst Reloads ein),
+            # dann verzögerte Reloads ausführen, beides mit noch offenem Client
+            await drain_background(SHUTDOWN_DRAIN_TIMEOUT)
+            await flush_reloads()
+            # Während des Wartens könnte eine neue Session begonnen haben
+            if _active_sessions == 0:
+                await cleanup_client()
+
 # MCP Server Instanz erstellen
 # Der Name sollte mit dem in der Claude Desktop Konfiguration übereinstimmen
-mcp = FastMCP("Hass-MCP", version="0.4.0", capabilities={ # Version erhöht
+mcp = FastMCP("Hass-MCP", version="0.4.0", lifespan=server_lifespan, capabilities={ # Version erhöht
     "resources": {},
     "tools": {},
     "prompts": {}
@@ -63,7 +119,8 @@ def async_handler(command_type: str):
             try:
                 return await func(*args, **kwargs)
             except Exception as e:
-                logger.error(f"Error in {func.__name__}: {str(e)}", exc_info=True)
+                logger.error("Error in %s: %r", func.__name__, e)
+                logger.debug("Traceback for %s", func.__name__, exc_info=True)
                 # Versuche, einen Fehler im erwarteten Rückgabetyp zurückzugeben
                 # Holt die Rückgabe-Annotation der dekorierten Funktion
                 return_annotation = func.__annotations__.get('return', None)
@@ -160,19 +217,18 @@ async def entity_action(entity_id: str, action: str, params: str) -> dict:
 
     # Prepare service data
     try:
-        import json
         # Handle different types of params input
         if not params or params.strip() == '':
             # Empty string
             params_dict = {}
         elif isinstance(params, str):
             # JSON string
-            params_dict = json.loads(params)
+            params_dict = orjson.loads(params)
         else:
             # Invalid input
             logger.warning(f"Invalid params type: {type(params)}. Expected string.")
             params_dict = {}
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logger.error(f"Error parsing params JSON: {e}, params: {params}")
         return {"error": f"Invalid JSON in params: {str(e)}", "params_received": params}
     except Exception as e:
@@ -451,7 +507,8 @@ async def list_automations() -> List[Dict[str, Any]]:
              return [] # Return empty list for unexpected types
 
     except Exception as e:
-        logger.error(f"Exception in list_automations: {str(e)}", exc_info=True)
+        logger.error("Exception in list_automations: %r", e)
+        logger.debug("Traceback for list_automations", exc_info=True)
         return [] # Return empty list on exception
 
 @mcp.tool()
@@ -491,9 +548,8 @@ async def call_service_tool(domain: str, service: str, data: str = None) -> Dict
     data_dict = {}
     if data:
         try:
-            import json
             if isinstance(data, str) and data.strip():
-                data_dict = json.loads(data)
+                data_dict = orjson.loads(data)
             elif isinstance(data, dict):
                 data_dict = data
         except Exception as e:
@@ -506,21 +562,16 @@ async def call_service_tool(domain: str, service: str, data: str = None) -> Dict
         # Direct API call
         client = await get_client()
         url = f"{HA_URL}/api/services/{domain}/{service}"
-        response = await client.post(
-            url,
-            headers=get_ha_headers(),
-            json=data_dict
-        )
+        response = await client.post(url, content=orjson.dumps(data_dict))
         response.raise_for_status()
         
         # Invalidate cache
-        global _entities_timestamp
-        _entities_timestamp = 0
+        entity_cache.invalidate()
         
         # Try to parse JSON response
         try:
-            return response.json()
-        except ValueError:
+            return orjson.loads(response.content)
+        except orjson.JSONDecodeError:
             # Return success if empty but status 200
             if response.status_code == 200:
                 return {
@@ -601,7 +652,8 @@ async def configure_component_tool(
     component_type: str,
     object_id: str,
     config_data: Dict[str, Any],
-    update: bool = False
+    update: bool = False,
+    eager: bool = False
 ) -> Dict[str, Any]:
     """
     Home Assistant Komponente erstellen oder aktualisieren.
@@ -615,6 +667,8 @@ async def configure_component_tool(
         object_id: ID der zu konfigurierenden Komponente
         config_data: Konfigurationsdaten für die Komponente
         update: True für Update, False für Neuanlage
+        eager: True, um nicht auf Home Assistant zu warten. Gibt sofort
+               {"result": "scheduled"} zurück; Fehler erscheinen nur im Log.
 
     Returns:
         Antwort von Home Assistant
@@ -638,9 +692,42 @@ async def configure_component_tool(
     }
     ```
     """
-    logger.info(f"Tool configure_component aufgerufen: Typ={component_type}, ID={object_id}, Update={update}")
+    logger.info(f"Tool configure_component aufgerufen: Typ={component_type}, ID={object_id}, Update={update}, Eager={eager}")
     # Ruft die importierte Funktion aus simplified_extensions auf
-    return await configure_ha_component(component_type, object_id, config_data, update)
+    return await configure_ha_component(component_type, object_id, config_data, update, eager)
+
+@mcp.tool()
+@async_handler("configure_components")
+async def configure_components_tool(
+    items: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    """
+    Mehrere Home Assistant Komponenten in einem Aufruf erstellen oder aktualisieren.
+
+    Die Einträge werden parallel an Home Assistant geschickt; danach wird jeder
+    betroffene Komponententyp nur einmal neu geladen. Schneller als viele
+    einzelne configure_component Aufrufe.
+
+    Args:
+        items: Liste von Komponenten, jeweils mit component_type, object_id,
+               config_data und optional update (wie bei configure_component)
+
+    Returns:
+        Eine Antwort von Home Assistant pro Eintrag, in derselben Reihenfolge
+
+    Beispiel:
+    ```json
+    {
+        "items": [
+            {"component_type": "script", "object_id": "lights_off", "config_data": {"alias": "Lichter aus", "sequence": []}},
+            {"component_type": "script", "object_id": "lights_on", "config_data": {"alias": "Lichter an", "sequence": []}}
+        ]
+    }
+    ```
+    """
+    logger.info(f"Tool configure_components aufgerufen: {len(items)} Einträge")
+    # Ruft die importierte Funktion aus simplified_extensions auf
+    return await configure_ha_components(items)
 
 @mcp.tool()
 @async_handler("delete_component")
@@ -1405,27 +1492,6 @@ You'll help the user create optimized dashboards by:
 
 # --- REST API Tools ---
 
-# Konfigurationskonstanten
-HA_URL = os.getenv("HA_URL", "http://localhost:8123")
-headers = {
-    "Authorization": f"Bearer {os.getenv('HA_TOKEN', '')}",
-    "Content-Type": "application/json"
-}
-
-async def get_client() -> aiohttp.ClientSession:
-    """
-    Erstellt oder gibt eine bestehende aiohttp Client-Session zurück
-    """
-    if not hasattr(get_client, "_session"):
-        get_client._session = aiohttp.ClientSession()
-    return get_client._session
-
-def get_ha_headers() -> Dict[str, str]:
-    """
-    Gibt die Standard-Header für Home Assistant API-Anfragen zurück
-    """
-    return headers.copy()
-
 async def api_call(method: str, endpoint: str, data: Optional[Dict] = None) -> Any:
     """
     Generische Funktion für API-Aufrufe
@@ -1439,22 +1505,21 @@ async def api_call(method: str, endpoint: str, data: Optional[Dict] = None) -> A
         API-Antwort als JSON
     """
     client = await get_client()
-    headers = get_ha_headers()
     url = f"{HA_URL}{endpoint}"
     
     try:
         if method.upper() == "GET":
-            async with client.get(url, headers=headers) as response:
-                response.raise_for_status()
-                return await response.json()
+            response = await client.get(url)
         elif method.upper() == "POST":
-            async with client.post(url, headers=headers, json=data) as response:
-                response.raise_for_status()
-                return await response.json()
+            body = orjson.dumps(data) if data is not None else None
+            response = await client.post(url, content=body)
         else:
             raise ValueError(f"Unsupported HTTP method: {method}")
-    except aiohttp.ClientError as e:
-        logger.error(f"API call error: {str(e)}", exc_info=True)
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    except httpx.HTTPError as e:
+        logger.error("API call error: %r", e)
+        logger.debug("Traceback for API call %s %s", method, endpoint, exc_info=True)
         return {"error": f"API call failed: {str(e)}"}
 
 @mcp.tool()
@@ -1726,7 +1791,8 @@ async def reload_ha(component: str = None, reload_all: bool = False) -> Dict[str
                     results[comp] = "Reloaded successfully"
             except Exception as e:
                 error_msg = f"Error reloading {comp}: {str(e)}"
-                logger.error(error_msg, exc_info=True)
+                logger.error(error_msg)
+                logger.debug("Traceback for reloading %s", comp, exc_info=True)
                 results[comp] = error_msg
     
     return {
@@ -1766,13 +1832,12 @@ async def light_control(entity_id: str, action: str) -> dict:
         # Direkter API-Aufruf anstatt call_service
         client = await get_client()
         url = f"{HA_URL}/api/services/{domain}/{service}"
-        response = await client.post(
-            url,
-            headers=get_ha_headers(),
-            json=data
-        )
+        response = await client.post(url, content=orjson.dumps(data))
         response.raise_for_status()
         
+        # Zwischengespeicherte Zustände sind nach der Aktion veraltet
+        entity_cache.invalidate()
+        
         # Erfolgreiche Antwort
         return {
             "success": True,
@@ -1801,6 +1866,7 @@ import asyncio # Importiere asyncio hier
 
 async def main():
     """Runs the MCP server using stdio."""
+    setup_logging()
     logger.info("Starting Hass-MCP server with stdio...")
     # Setup cleanup hook for the HTTP client
     # Note: stdio_server might not have explicit shutdown hooks,
@@ -4,28 +4,258 @@ Erweiterungsmodul für Home Assistant Interaktionen.
 Bietet allgemeine, flexible Funktionen zur Steuerung und Konfiguration von Home Assistant.
 """
 
+import asyncio
+import functools
+import hashlib
 import logging
-import json
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Set, Tuple, Union, Callable, Awaitable
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
 # Import existing functions from app.hass and config
-from app.hass import call_service, get_entity_state, get_client, handle_api_errors
-from app.config import HA_URL, get_ha_headers
+from app.hass import (
+    call_service, get_entity_state, get_client, get_http_error_message, handle_api_errors, SimpleCache
+)
+from app.config import HA_URL
 import httpx # Import httpx für direkte API-Aufrufe hier
+import orjson # Schnellere JSON-(De-)Serialisierung für Konfigurationsdaten
+
+# Basis-URL der Konfigurations-API
+_CFG_URL = f"{HA_URL}/api/config/"
+
+# --- Cache für identische Konfigurationsaufrufe ---
+
+# Kurzlebiger Cache für erfolgreiche Antworten von configure_ha_component, damit
+# wiederholte identische Aufrufe (z.B. Retries eines MCP-Clients) nicht erneut
+# an Home Assistant gehen
+config_response_cache = SimpleCache(ttl_seconds=5, max_entries=256)
+
+
+def _config_cache_prefix(component_type: str, object_id: str) -> str:
+    """Schlüssel-Präfix für alle gecachten Antworten einer Komponente"""
+    return f"{component_type}/{object_id}/"
+
+
+def _config_cache_key(component_type: str, object_id: str, config_data: Dict[str, Any], update: bool) -> str:
+    """Cache-Schlüssel aus Komponente und einem Hash der Konfigurationsdaten"""
+    payload = orjson.dumps(config_data, option=orjson.OPT_SORT_KEYS, default=str)
+    digest = hashlib.blake2b(payload, digest_size=16).hexdigest()
+    return f"{_config_cache_prefix(component_type, object_id)}{digest}_{update}"
+
+# --- Gebündelte Reloads ---
+
+# Komponententypen, die nach einer Konfigurationsänderung neu geladen werden
+_RELOADABLE: frozenset = frozenset({"automation", "script", "scene"})
+
+# Zeitfenster, in dem mehrere Änderungen am selben Komponententyp
+# zu einem einzigen Reload zusammengefasst werden
+RELOAD_DEBOUNCE_SECONDS = 0.25
+
+# Höchstens so lange nach der ersten Änderung wird der Reload aufgeschoben,
+# auch wenn laufend weitere Änderungen eintreffen
+RELOAD_MAX_WAIT_SECONDS = 2.0
+
+# Geplante (noch nicht gestartete) Reloads pro Komponententyp
+_pending_reloads: Dict[str, asyncio.TimerHandle] = {}
+
+# Spätester Startzeitpunkt (loop.time()) der geplanten Reloads
+_reload_deadlines: Dict[str, float] = {}
+
+# Laufende Reload-Tasks (starke Referenzen, damit sie nicht eingesammelt werden)
+_reload_tasks: Set[asyncio.Task] = set()
+
+
+def _schedule_reload(component_type: str) -> None:
+    """
+    Reload eines Komponententyps verzögert einplanen
+
+    Weitere Aufrufe innerhalb von RELOAD_DEBOUNCE_SECONDS verschieben den
+    geplanten Reload nur, sodass Home Assistant die Konfiguration einmal
+    statt nach jeder einzelnen Änderung neu einliest. Spätestens
+    RELOAD_MAX_WAIT_SECONDS nach der ersten Änderung wird trotzdem geladen.
+    """
+    handle = _pending_reloads.pop(component_type, None)
+    if handle is not None:
+        handle.cancel()
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    deadline = _reload_deadlines.setdefault(component_type, now + RELOAD_MAX_WAIT_SECONDS)
+    delay = min(RELOAD_DEBOUNCE_SECONDS, max(0.0, deadline - now))
+    _pending_reloads[component_type] = loop.call_later(delay, _start_reload, component_type)
+
+
+def _start_reload(component_type: str) -> asyncio.Task:
+    """Reload sofort als Hintergrund-Task starten"""
+    _pending_reloads.pop(component_type, None)
+    _reload_deadlines.pop(component_type, None)
+    task = asyncio.create_task(call_service(component_type, "reload", {}))
+    _reload_tasks.add(task)
+    task.add_done_callback(functools.partial(_reload_done, component_type))
+    return task
+
+
+def _reload_done(component_type: str, task: asyncio.Task) -> None:
+    """Abgeschlossenen Reload austragen und Fehler protokollieren"""
+    _reload_tasks.discard(task)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is None:
+        result = task.result()
+        error = result.get("error") if isinstance(result, dict) else None
+    if error:
+        logger.warning("Konnte %s nicht neu laden: %s", component_type, error)
+
+
+# Hintergrund-Tasks aus configure_ha_component(eager=True)
+_background: Set[asyncio.Task] = set()
+
+
+async def drain_background(timeout: Optional[float] = None) -> None:
+    """
+    Auf alle im Hintergrund laufenden Konfigurationsaufrufe warten
+
+    Wird beim Herunterfahren vor flush_reloads() aufgerufen, damit eager
+    abgesetzte Anfragen nicht mit dem Schließen des Clients verloren gehen.
+    Nach `timeout` Sekunden wird nicht länger gewartet.
+    """
+    if _background:
+        _, pending = await asyncio.wait(set(_background), timeout=timeout)
+        if pending:
+            logger.warning("%d Konfigurationsaufrufe im Hintergrund nicht abgeschlossen", len(pending))
+
+
+async def flush_reloads() -> None:
+    """
+    Alle geplanten Reloads sofort ausführen und auf laufende warten
+
+    Wird beim Herunterfahren aufgerufen, solange der HTTP-Client noch offen
+    ist, damit kurz vorher gemachte Änderungen noch geladen werden.
+    """
+    for component_type, handle in list(_pending_reloads.items()):
+        handle.cancel()
+        _start_reload(component_type)
+    if _reload_tasks:
+        await asyncio.gather(*_reload_tasks, return_exceptions=True)
+
+def _format_http_error_from_response(response: httpx.Response) -> str:
+    """Fehlermeldung aus einer HTTP-Fehlerantwort erzeugen (Body wird nur einmal geparst)"""
+    msg = get_http_error_message(response)
+    error = f"HTTP error {response.status_code} - {response.reason_phrase}"
+    return f"{error}: {msg}" if msg else error
 
 # --- Bestehende Funktionen ---
 
 # (configure_ha_component, delete_ha_component, set_entity_attributes)
 # ... (Code der bestehenden Funktionen hier einfügen) ...
 
+async def _send_config(
+    component_type: str,
+    url: str,
+    reload: bool,
+    object_id: str,
+    config_data: Dict[str, Any],
+    update: bool,
+    _skip_reload: bool
+) -> Dict[str, Any]:
+    """Konfiguration an die Config-API senden und Reload einplanen"""
+    # Gemeinsamen Client bei jedem Aufruf holen: nach cleanup_client()
+    # wird er neu erzeugt, eine eigene Kopie wäre dann geschlossen
+    client = await get_client()
+
+    logger.info("%s %s: %s", "Aktualisiere" if update else "Erstelle", component_type, object_id)
+
+    try:
+        # API-Aufruf
+        # Für viele Konfigurationen (wie Automatisierungen) wird immer POST verwendet,
+        # auch für Updates. Das Verhalten kann je nach Komponententyp variieren.
+        # Wir gehen hier von POST für beides aus, was für Automatisierungen etc. üblich ist.
+        # Header (inkl. Content-Type) setzt der gemeinsame Client
+        response = await client.post(url, content=orjson.dumps(config_data))
+
+        # Alles außer 2xx direkt auswerten statt über raise_for_status() und Exception.
+        # Auch 3xx: Redirects werden nicht verfolgt, die Konfiguration wurde dann nicht geschrieben
+        if not response.is_success:
+            # Detailliertere Fehlermeldung bei HTTP-Fehlern
+            error_details = _format_http_error_from_response(response)
+            logger.error("Fehler beim Konfigurieren von %s %s: %s", component_type, object_id, error_details)
+            return {"error": error_details}
+
+        # Abhängig vom Komponententyp nachladen (gebündelt im Hintergrund)
+        if reload and not _skip_reload:
+            _schedule_reload(component_type)
+
+        # JSON zurückgeben, wenn vorhanden, ansonsten generische Erfolgsmeldung
+        # (leere oder Nicht-JSON-Antworten gar nicht erst parsen)
+        if response.content and "json" in response.headers.get("content-type", ""):
+            try:
+                return orjson.loads(response.content)
+            except orjson.JSONDecodeError:
+                pass
+        return {"result": "success", "message": f"{component_type} {object_id} {'updated' if update else 'created'} successfully."}
+
+    except Exception as e:
+        # Nur noch Netzwerk- und unerwartete Fehler
+        logger.error("Unerwarteter Fehler beim Konfigurieren von %s %s: %r", component_type, object_id, e)
+        # Traceback nur auf DEBUG, um ihn bei Fehlerserien nicht jedes Mal zu formatieren
+        logger.debug("Traceback für %s %s", component_type, object_id, exc_info=True)
+        return {"error": f"Unexpected error configuring {component_type} {object_id}: {str(e)}"}
+
+
+def _make_configure(component_type: str) -> Callable[..., Awaitable[Dict[str, Any]]]:
+    """
+    Konfigurationsfunktion für einen festen Komponententyp erzeugen
+
+    Der URL-Präfix wird einmal berechnet und in der Closure festgehalten,
+    statt bei jedem Aufruf neu zusammengesetzt zu werden. Die Komponente
+    wird nach Änderungen neu geladen.
+    """
+    url_prefix = "".join((_CFG_URL, component_type, "/config/"))
+
+    async def configure(
+        _component_type: str,
+        object_id: str,
+        config_data: Dict[str, Any],
+        update: bool = False,
+        _skip_reload: bool = False
+    ) -> Dict[str, Any]:
+        return await _send_config(
+            component_type, url_prefix + object_id, True, object_id, config_data, update, _skip_reload
+        )
+
+    configure.__name__ = f"configure_{component_type}"
+    return configure
+
+
+async def _configure_generic(
+    component_type: str,
+    object_id: str,
+    config_data: Dict[str, Any],
+    update: bool = False,
+    _skip_reload: bool = False
+) -> Dict[str, Any]:
+    """Konfigurationsfunktion für seltene Komponententypen (ohne Reload)"""
+    # Konstruiere die API-URL
+    # Korrektur: API verwendet POST für Erstellung/Update von config Einträgen
+    url = "".join((_CFG_URL, component_type, "/config/", object_id))
+    return await _send_config(component_type, url, False, object_id, config_data, update, _skip_reload)
+
+
+# Vorab erzeugte Konfigurationsfunktionen für die nachladbaren Komponententypen
+_SPECIALIZED: Dict[str, Callable[..., Awaitable[Dict[str, Any]]]] = {
+    component_type: _make_configure(component_type)
+    for component_type in _RELOADABLE
+}
+
+
 async def configure_ha_component(
     component_type: str,
     object_id: str,
     config_data: Dict[str, Any],
-    update: bool = False
+    update: bool = False,
+    eager: bool = False,
+    _skip_reload: bool = False
 ) -> Dict[str, Any]:
     """
     Flexible Funktion zum Erstellen oder Aktualisieren von HA-Komponenten
@@ -38,58 +268,101 @@ async def configure_ha_component(
         object_id: ID der Komponente
         config_data: Konfigurationsdaten für die Komponente
         update: True für Update, False für Neuanlage
+        eager: True, um die Anfrage nur im Hintergrund abzusetzen und sofort
+               {"result": "scheduled"} zurückzugeben. Fehler sind dann nur
+               noch im Log sichtbar (siehe drain_background).
+        _skip_reload: Intern (Batch-Betrieb): keinen Reload einplanen
 
     Returns:
-        Antwort von Home Assistant
+        Antwort von Home Assistant. Automatisierungen, Skripte und Szenen
+        werden danach gebündelt im Hintergrund neu geladen (siehe flush_reloads).
     """
-    client = await get_client()
-    headers = get_ha_headers()
-
-    logger.info(f"{'Aktualisiere' if update else 'Erstelle'} {component_type}: {object_id}")
+    if eager:
+        # Fire-and-forget: Anfrage als Hintergrund-Task starten
+        task = asyncio.create_task(
+            configure_ha_component(component_type, object_id, config_data, update, _skip_reload=_skip_reload)
+        )
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+        return {"result": "scheduled", "message": f"{component_type} {object_id} wird im Hintergrund konfiguriert."}
+
+    # Identischer Aufruf innerhalb der TTL: gespeicherte Antwort zurückgeben
+    cache_key = _config_cache_key(component_type, object_id, config_data, update)
+    cached_result = config_response_cache.get(cache_key)
+    if cached_result is not None:
+        logger.debug("Cache hit for configure_ha_component - %s", cache_key)
+        return cached_result
+    logger.debug("Cache miss for configure_ha_component - %s", cache_key)
+
+    # Spezialisierte Funktion verwenden, seltene Typen generisch behandeln
+    configure = _SPECIALIZED.get(component_type, _configure_generic)
+    result = await configure(component_type, object_id, config_data, update, _skip_reload)
+
+    # Fehler nicht cachen
+    if not (isinstance(result, dict) and result.get("error")):
+        # Die Komponente hat jetzt diese Konfiguration: zuvor gecachte Antworten
+        # für andere Daten sind veraltet (sonst würde A -> B -> A das letzte A
+        # ohne Anfrage beantworten und B bliebe in Home Assistant stehen)
+        config_response_cache.invalidate(_config_cache_prefix(component_type, object_id))
+        config_response_cache.set(cache_key, result)
+    return result
+
+
+async def configure_ha_components(
+    items: List[Dict[str, Any]],
+    concurrency: int = 8
+) -> List[Dict[str, Any]]:
+    """
+    Mehrere HA-Komponenten parallel erstellen oder aktualisieren
 
-    # Konstruiere den API-Pfad
-    # Korrektur: API verwendet POST für Erstellung/Update von config Einträgen
-    api_path = f"/api/config/{component_type}/config/{object_id}"
+    Bis zu `concurrency` Aufrufe laufen gleichzeitig. Danach wird jeder
+    betroffene Komponententyp genau einmal neu geladen.
 
-    try:
-        # API-Aufruf
-        # Für viele Konfigurationen (wie Automatisierungen) wird immer POST verwendet,
-        # auch für Updates. Das Verhalten kann je nach Komponententyp variieren.
-        # Wir gehen hier von POST für beides aus, was für Automatisierungen etc. üblich ist.
-        response = await client.post(f"{HA_URL}{api_path}", headers=headers, json=config_data)
+    Args:
+        items: Liste von Dicts mit component_type, object_id, config_data und
+               optional update. Weitere Schlüssel werden ignoriert.
+        concurrency: Maximale Anzahl gleichzeitiger Anfragen (mindestens 1)
 
-        response.raise_for_status() # Löst eine Ausnahme für 4xx/5xx Fehler aus
+    Returns:
+        Eine Antwort pro Eintrag, in derselben Reihenfolge wie items
+    """
+    # Bei 0 würde jeder Aufruf ewig auf die Semaphore warten
+    if concurrency < 1:
+        raise ValueError("concurrency must be >= 1")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def configure_one(item: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            # Nur die bekannten Argumente übergeben: z.B. "eager" aus den Items
+            # würde die Anfrage erst nach dem gemeinsamen Reload absetzen
+            return await configure_ha_component(
+                item["component_type"],
+                item["object_id"],
+                item["config_data"],
+                update=bool(item.get("update", False)),
+                _skip_reload=True
+            )
+
+    raw_results = await asyncio.gather(*(configure_one(item) for item in items), return_exceptions=True)
+    results = [
+        {"error": f"Unexpected error configuring component: {str(result)}"}
+        if isinstance(result, Exception) else result
+        for result in raw_results
+    ]
+
+    # Ein Reload pro Komponententyp statt einem pro Eintrag, und nur für Typen
+    # mit mindestens einer erfolgreichen Änderung
+    changed_types = {
+        item.get("component_type")
+        for item, result in zip(items, results)
+        if not (isinstance(result, dict) and result.get("error"))
+    }
+    for component_type in changed_types & _RELOADABLE:
+        result = await call_service(component_type, "reload", {})
+        if isinstance(result, dict) and result.get("error"):
+            logger.warning("Konnte %s nicht neu laden: %s", component_type, result["error"])
 
-        # Abhängig vom Komponententyp nachladen (optional, aber oft sinnvoll)
-        if component_type in ["automation", "script", "scene"]:
-            try:
-                await call_service(component_type, "reload", {})
-            except Exception as reload_err:
-                logger.warning(f"Konnte {component_type} nach Konfiguration nicht neu laden: {reload_err}")
-                # Gib trotzdem Erfolg zurück, da die Konfiguration gespeichert wurde
-                return {"result": "success", "warning": f"Component {component_type} configured, but reload failed."}
-
-
-        # Versuche JSON zurückzugeben, wenn vorhanden, ansonsten generische Erfolgsmeldung
-        try:
-            return response.json()
-        except json.JSONDecodeError:
-            return {"result": "success", "message": f"{component_type} {object_id} {'updated' if update else 'created'} successfully."}
-
-    except httpx.HTTPStatusError as e:
-         # Detailliertere Fehlermeldung bei HTTP-Fehlern
-        error_details = f"HTTP error {e.response.status_code} - {e.response.reason_phrase}"
-        try:
-            # Versuche, den Fehlertext aus der Antwort zu extrahieren
-            error_body = e.response.json()
-            error_details += f": {error_body.get('message', e.response.text)}"
-        except json.JSONDecodeError:
-             error_details += f": {e.response.text}" # Fallback auf Text
-        logger.error(f"Fehler beim Konfigurieren von {component_type} {object_id}: {error_details}")
-        return {"error": error_details}
-    except Exception as e:
-        logger.error(f"Unerwarteter Fehler beim Konfigurieren von {component_type} {object_id}: {str(e)}", exc_info=True)
-        return {"error": f"Unexpected error configuring {component_type} {object_id}: {str(e)}"}
+    return results
 
 
 async def delete_ha_component(
@@ -104,45 +377,76 @@ async def delete_ha_component(
         object_id: ID der Komponente
 
     Returns:
-        Antwort von Home Assistant
+        Antwort von Home Assistant. Automatisierungen, Skripte und Szenen
+        werden danach gebündelt im Hintergrund neu geladen (siehe flush_reloads).
     """
+    # Gecachte Konfigurationsantworten dieser Komponente sind nicht mehr gültig
+    config_response_cache.invalidate(_config_cache_prefix(component_type, object_id))
+
     client = await get_client()
-    headers = get_ha_headers()
 
-    logger.info(f"Lösche {component_type}: {object_id}")
+    logger.info("Lösche %s: %s", component_type, object_id)
 
-    # Konstruiere den API-Pfad
-    api_path = f"/api/config/{component_type}/config/{object_id}"
+    # Konstruiere die API-URL
+    url = "".join((_CFG_URL, component_type, "/config/", object_id))
 
     try:
         # API-Aufruf
-        response = await client.delete(f"{HA_URL}{api_path}", headers=headers)
-        response.raise_for_status()
-
-        # Abhängig vom Komponententyp nachladen
-        if component_type in ["automation", "script", "scene"]:
-            try:
-                await call_service(component_type, "reload", {})
-            except Exception as reload_err:
-                 logger.warning(f"Konnte {component_type} nach dem Löschen nicht neu laden: {reload_err}")
-                 return {"result": "success", "warning": f"Component {component_type} deleted, but reload failed."}
+        response = await client.delete(url)
+        if not response.is_success:
+            error_details = _format_http_error_from_response(response)
+            logger.error("Fehler beim Löschen von %s %s: %s", component_type, object_id, error_details)
+            return {"error": error_details}
 
+        # Abhängig vom Komponententyp nachladen (gebündelt im Hintergrund)
+        if component_type in _RELOADABLE:
+            _schedule_reload(component_type)
 
         return {"result": "success", "message": f"{component_type} {object_id} gelöscht"}
-    except httpx.HTTPStatusError as e:
-        error_details = f"HTTP error {e.response.status_code} - {e.response.reason_phrase}"
-        try:
-            error_body = e.response.json()
-            error_details += f": {error_body.get('message', e.response.text)}"
-        except json.JSONDecodeError:
-             error_details += f": {e.response.text}"
-        logger.error(f"Fehler beim Löschen von {component_type} {object_id}: {error_details}")
-        return {"error": error_details}
     except Exception as e:
-        logger.error(f"Unerwarteter Fehler beim Löschen von {component_type} {object_id}: {str(e)}", exc_info=True)
+        # Nur noch Netzwerk- und unerwartete Fehler
+        logger.error("Unerwarteter Fehler beim Löschen von %s %s: %r", component_type, object_id, e)
+        logger.debug("Traceback für %s %s", component_type, object_id, exc_info=True)
         return {"error": f"Unexpected error deleting {component_type} {object_id}: {str(e)}"}
 
 
+# Service-Auswahl für set_entity_attributes: pro Domain geordnete Paare aus
+# (Attribut, Service). Light und Switch nutzen immer turn_on (Fallback).
+_DOMAIN_DISPATCH: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "climate": (
+        ("temperature", "set_temperature"),
+        ("hvac_mode", "set_hvac_mode"),
+        ("fan_mode", "set_fan_mode"),
+        ("swing_mode", "set_swing_mode"),
+        ("preset_mode", "set_preset_mode"),
+    ),
+    "cover": (
+        ("position", "set_cover_position"),
+        ("tilt_position", "set_cover_tilt_position"),
+    ),
+    "fan": (
+        ("percentage", "set_percentage"),
+        ("preset_mode", "set_preset_mode"),
+        ("oscillating", "oscillate"),
+    ),
+    "media_player": (
+        ("volume_level", "volume_set"),
+        ("is_volume_muted", "volume_mute"),
+        ("source", "select_source"),
+        ("media_content_id", "play_media"),
+    ),
+    # ... weitere Domains könnten hinzugefügt werden
+}
+
+# Service, wenn keines der Attribute aus _DOMAIN_DISPATCH gesetzt ist
+_DOMAIN_FALLBACK: Dict[str, str] = {
+    "climate": "turn_on",
+    "cover": "open_cover",
+    "fan": "turn_on",
+    "media_player": "media_play",
+}
+
+
 async def set_entity_attributes(
     entity_id: str,
     attributes: Dict[str, Any]
@@ -164,48 +468,25 @@ async def set_entity_attributes(
     domain = entity_id.split(".")[0]
 
     # Servicedaten vorbereiten (entity_id wird oft nicht in 'data' benötigt,
-    # sondern nur im 'target'-Teil des Serviceaufrufs, aber call_service erwartet es so)
-    data = {
-        "entity_id": entity_id,
-        **attributes
-    }
+    # sondern nur im 'target'-Teil des Serviceaufrufs, aber call_service erwartet es so).
+    # Flache Kopie statt Entpacken in ein neues Literal; call_service verändert
+    # die Daten nicht, braucht aber ein echtes dict für die JSON-Serialisierung.
+    data = attributes.copy()
+    data["entity_id"] = entity_id
 
     # Passenden Service basierend auf der Domain und den Attributen auswählen
     # Dies ist eine Heuristik und deckt nicht alle Fälle ab!
-    service = "turn_on" # Standardannahme für viele Domains
-
-    if domain == "light":
-        # Licht hat einen turn_on Service, der viele Attribute akzeptiert
+    if domain == "light" or domain == "switch":
+        # Häufigster Fall: turn_on akzeptiert alle Attribute, Tabelle nicht nötig
         service = "turn_on"
-    elif domain == "switch":
-        # Switch hat turn_on/off, Attribute sind selten
-        service = "turn_on" # Oder turn_off basierend auf Attributen? Schwierig.
-    elif domain == "climate":
-        # Klimageräte haben spezifische Services
-        if "temperature" in attributes: service = "set_temperature"
-        elif "hvac_mode" in attributes: service = "set_hvac_mode"
-        elif "fan_mode" in attributes: service = "set_fan_mode"
-        elif "swing_mode" in attributes: service = "set_swing_mode"
-        elif "preset_mode" in attributes: service = "set_preset_mode"
-        else: service = "turn_on" # Fallback
-    elif domain == "cover":
-        if "position" in attributes: service = "set_cover_position"
-        elif "tilt_position" in attributes: service = "set_cover_tilt_position"
-        else: service = "open_cover" # Fallback
-    elif domain == "fan":
-        if "percentage" in attributes: service = "set_percentage"
-        elif "preset_mode" in attributes: service = "set_preset_mode"
-        elif "oscillating" in attributes: service = "oscillate"
-        else: service = "turn_on" # Fallback
-    elif domain == "media_player":
-        if "volume_level" in attributes: service = "volume_set"
-        elif "is_volume_muted" in attributes: service = "volume_mute"
-        elif "source" in attributes: service = "select_source"
-        elif "media_content_id" in attributes: service = "play_media"
-        else: service = "media_play" # Fallback
-    # ... weitere Domains könnten hinzugefügt werden
-
-    logger.info(f"Versuche Service '{service}' für Domain '{domain}' mit Daten: {data}")
+    else:
+        # Das erste passende Attribut aus der Tabelle gewinnt, sonst der Fallback der Domain
+        service = next(
+            (svc for attr, svc in _DOMAIN_DISPATCH.get(domain, ()) if attr in attributes),
+            _DOMAIN_FALLBACK.get(domain, "turn_on") # Standardannahme für viele Domains
+        )
+
+    logger.info("Versuche Service '%s' für Domain '%s' mit Daten: %s", service, domain, data)
 
     # Service aufrufen (verwende die Originalfunktion aus hass.py)
     return await call_service(domain, service, data)
@@ -8,6 +8,13 @@ import httpx
 # Add app directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Import the server module once per session instead of in every test
+@pytest.fixture(scope="session")
+def server_mod():
+    """Return the app.server module."""
+    import app.server
+    return app.server
+
 # Mock environment variables before imports
 @pytest.fixture(autouse=True)
 def mock_env_vars():
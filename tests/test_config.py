@@ -31,6 +31,22 @@ class TestConfig:
             # Check header value
             assert headers['Content-Type'] == 'application/json'
     
+    def test_get_ha_headers_is_shared_and_read_only(self):
+        """Test that headers are built once per token and cannot be mutated."""
+        with patch('app.config.HA_TOKEN', 'test_token'):
+            headers = get_ha_headers()
+            
+            # Same mapping is returned while the token is unchanged
+            assert get_ha_headers() is headers
+            
+            # Shared mapping must not be modifiable by callers
+            with pytest.raises(TypeError):
+                headers['X-Test'] = 'value'
+        
+        with patch('app.config.HA_TOKEN', 'other_token'):
+            # A new token yields a new mapping
+            assert get_ha_headers()['Authorization'] == 'Bearer other_token'
+    
     def test_environment_variable_defaults(self):
         """Test that environment variables have sensible defaults."""
         # Instead of mocking os.environ.get completely, let's verify the expected defaults
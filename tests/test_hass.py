@@ -2,6 +2,7 @@ import pytest
 import asyncio
 from unittest.mock import MagicMock, patch, AsyncMock
 import json
+import orjson
 import httpx
 from typing import Dict, List, Any
 
@@ -22,7 +23,7 @@ class TestHassAPI:
         # Create mock response
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
-        mock_response.json.return_value = mock_states
+        mock_response.content = orjson.dumps(mock_states)
         
         # Create properly awaitable mock
         mock_client = MagicMock()
@@ -53,7 +54,7 @@ class TestHassAPI:
         # Create mock response
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
-        mock_response.json.return_value = mock_state
+        mock_response.content = orjson.dumps(mock_state)
         
         # Create properly awaitable mock
         mock_client = MagicMock()
@@ -76,6 +77,32 @@ class TestHassAPI:
                     called_url = mock_client.get.call_args[0][0]
                     assert called_url == f"{mock_config['hass_url']}/api/states/light.living_room"
 
+    @pytest.mark.asyncio
+    async def test_concurrent_cache_misses_share_one_request(self, mock_config):
+        """Test that concurrent calls for the same uncached key issue a single request."""
+        from app.hass import entity_cache
+        entity_cache.invalidate()
+
+        mock_response = MagicMock()
+        mock_response.raise_for_status = MagicMock()
+        mock_response.content = orjson.dumps({"entity_id": "light.hallway", "state": "on"})
+
+        async def slow_get(*args, **kwargs):
+            await asyncio.sleep(0.01)
+            return mock_response
+
+        mock_client = MagicMock()
+        mock_client.get = AsyncMock(side_effect=slow_get)
+
+        with patch('app.hass.get_client', return_value=mock_client):
+            with patch('app.hass.HA_URL', mock_config["hass_url"]):
+                with patch('app.hass.HA_TOKEN', mock_config["hass_token"]):
+                    results = await asyncio.gather(*(get_entity_state("light.hallway") for _ in range(5)))
+
+        assert all(result["state"] == "on" for result in results)
+        mock_client.get.assert_called_once()
+        entity_cache.invalidate()
+
     @pytest.mark.asyncio
     async def test_call_service(self, mock_config):
         """Test calling a service."""
@@ -86,7 +113,7 @@ class TestHassAPI:
         # Create mock response
         mock_response = MagicMock()
         mock_response.raise_for_status = MagicMock()
-        mock_response.json.return_value = {"result": "ok"}
+        mock_response.content = orjson.dumps({"result": "ok"})
         
         # Create properly awaitable mock
         mock_client = MagicMock()
@@ -106,10 +133,196 @@ class TestHassAPI:
                         # Verify API was called correctly
                         mock_client.post.assert_called_once()
                         called_url = mock_client.post.call_args[0][0]
-                        called_data = mock_client.post.call_args[1].get('json')
+                        called_data = orjson.loads(mock_client.post.call_args[1].get('content'))
                         assert called_url == f"{mock_config['hass_url']}/api/services/{domain}/{service}"
                         assert called_data == data
 
+    @pytest.mark.asyncio
+    async def test_call_service_invalidates_entity_cache(self, mock_config):
+        """Test that a service call drops cached entity states."""
+        from app.hass import entity_cache
+        entity_cache.invalidate()
+
+        mock_response = MagicMock()
+        mock_response.raise_for_status = MagicMock()
+        mock_response.content = orjson.dumps([{"entity_id": "light.living_room", "state": "off"}])
+
+        mock_client = MagicMock()
+        mock_client.get = AsyncMock(return_value=mock_response)
+        mock_client.post = AsyncMock(return_value=mock_response)
+
+        with patch('app.hass.get_client', return_value=mock_client):
+            with patch('app.hass.HA_TOKEN', mock_config["hass_token"]):
+                await get_entities()
+                await get_entities()
+                assert mock_client.get.await_count == 1
+
+                await call_service("light", "turn_on", {"entity_id": "light.living_room"})
+                await get_entities()
+                assert mock_client.get.await_count == 2
+
+        entity_cache.invalidate()
+
+    @pytest.mark.asyncio
+    async def test_call_service_detaches_in_flight_reads(self, mock_config):
+        """Test that a read in flight during a service call is neither joined nor cached afterwards."""
+        from app.hass import entity_cache
+        entity_cache.invalidate()
+
+        state = {"value": "off"}
+        first_started = asyncio.Event()
+        release_first = asyncio.Event()
+
+        async def get(*args, **kwargs):
+            # The state is read when the request starts, the answer arrives later
+            snapshot = state["value"]
+            if not first_started.is_set():
+                first_started.set()
+                await release_first.wait()
+            mock_response = MagicMock()
+            mock_response.raise_for_status = MagicMock()
+            mock_response.content = orjson.dumps({"entity_id": "light.hallway", "state": snapshot})
+            return mock_response
+
+        async def post(*args, **kwargs):
+            state["value"] = "on"
+            mock_response = MagicMock()
+            mock_response.raise_for_status = MagicMock()
+            mock_response.content = orjson.dumps([])
+            return mock_response
+
+        mock_client = MagicMock()
+        mock_client.get = AsyncMock(side_effect=get)
+        mock_client.post = AsyncMock(side_effect=post)
+
+        with patch('app.hass.get_client', return_value=mock_client):
+            with patch('app.hass.HA_TOKEN', mock_config["hass_token"]):
+                early = asyncio.create_task(get_entity_state("light.hallway", lean=False))
+                await first_started.wait()
+
+                await call_service("light", "turn_on", {"entity_id": "light.hallway"})
+
+                # A read after the service call starts a fresh request
+                late = await asyncio.wait_for(get_entity_state("light.hallway", lean=False), 1)
+                assert late["state"] == "on"
+                assert mock_client.get.await_count == 2
+
+                # The earlier read still completes, but must not overwrite the cache
+                release_first.set()
+                assert (await early)["state"] == "off"
+                cached = await get_entity_state("light.hallway", lean=False)
+                assert cached["state"] == "on"
+                assert mock_client.get.await_count == 2
+
+        entity_cache.invalidate()
+
+    @pytest.mark.asyncio
+    async def test_call_service_http_error(self, mock_config):
+        """Test that service call HTTP errors include the response message."""
+        request = httpx.Request("POST", f"{mock_config['hass_url']}/api/services/light/turn_on")
+        
+        # Create properly awaitable mock
+        mock_client = MagicMock()
+        
+        with patch('app.hass.get_client', return_value=mock_client):
+            with patch('app.hass.HA_TOKEN', mock_config["hass_token"]):
+                # JSON error body with a message
+                mock_client.post = AsyncMock(return_value=httpx.Response(
+                    400, json={"message": "Invalid entity"}, request=request))
+                result = await call_service("light", "turn_on", {"entity_id": "light.unknown"})
+                assert result == {"error": "HTTP error 400: Invalid entity", "status_code": 400}
+                
+                # Plain text error body
+                mock_client.post = AsyncMock(return_value=httpx.Response(
+                    404, text="Service not found", request=request))
+                result = await call_service("light", "turn_on", {})
+                assert result == {"error": "HTTP error 404: Service not found", "status_code": 404}
+                
+                # Empty error body
+                mock_client.post = AsyncMock(return_value=httpx.Response(500, request=request))
+                result = await call_service("light", "turn_on", {})
+                assert result == {"error": "HTTP error 500", "status_code": 500}
+
+    @pytest.mark.asyncio
+    async def test_get_entity_history(self, mock_config):
+        """Test that the entity check and the history request are both issued."""
+        from app.hass import get_entity_history, entity_cache
+        entity_cache.invalidate()
+
+        responses = {
+            "/api/states/sensor.temperature": {"entity_id": "sensor.temperature", "state": "21.5"},
+            "/api/history/period/": [[
+                {"state": "20.0", "last_changed": "2025-03-15T07:00:00Z", "attributes": {}},
+                {"state": "21.5", "last_changed": "2025-03-15T08:00:00Z", "attributes": {}},
+            ]],
+        }
+
+        async def fake_get(url, **kwargs):
+            mock_response = MagicMock()
+            mock_response.raise_for_status = MagicMock()
+            path = next(p for p in responses if p in url)
+            mock_response.content = orjson.dumps(responses[path])
+            return mock_response
+
+        mock_client = MagicMock()
+        mock_client.get = AsyncMock(side_effect=fake_get)
+
+        with patch('app.hass.get_client', return_value=mock_client):
+            with patch('app.hass.HA_URL', mock_config["hass_url"]):
+                with patch('app.hass.HA_TOKEN', mock_config["hass_token"]):
+                    history = await get_entity_history("sensor.temperature", use_cache=False)
+
+        assert mock_client.get.await_count == 2
+        assert history["count"] == 2
+        assert [s["state"] for s in history["states"]] == ["20.0", "21.5"]
+
+        # A failing history request reports its own error, not the task group wrapper
+        mock_client.get = AsyncMock(side_effect=httpx.ConnectError("connection refused"))
+        with patch('app.hass.get_client', return_value=mock_client):
+            with patch('app.hass.HA_TOKEN', mock_config["hass_token"]):
+                history = await get_entity_history("sensor.temperature", use_cache=False)
+
+        assert "connection refused" in history["error"]
+
+        # For a missing entity the existence error wins over a failing history request
+        async def missing_get(url, **kwargs):
+            request = httpx.Request("GET", url)
+            if "/api/states/" in url:
+                await asyncio.sleep(0.01)
+                return httpx.Response(404, request=request)
+            return httpx.Response(500, request=request)
+
+        mock_client.get = AsyncMock(side_effect=missing_get)
+        with patch('app.hass.get_client', return_value=mock_client):
+            with patch('app.hass.HA_TOKEN', mock_config["hass_token"]):
+                history = await get_entity_history("sensor.missing", use_cache=False)
+
+        assert history["error"] == "HTTP error: 404 - Not Found"
+        assert history["count"] == 0
+        entity_cache.invalidate()
+
+    @pytest.mark.asyncio
+    async def test_summarize_domain(self, mock_config):
+        """Test state counts, capped examples and attribute ranking in domain summaries."""
+        from app.hass import summarize_domain
+
+        mock_entities = [
+            {"entity_id": f"light.on_{i}", "state": "on", "attributes": {"friendly_name": f"On {i}", "brightness": 255}}
+            for i in range(3)
+        ] + [
+            {"entity_id": "light.off", "state": "off", "attributes": {"friendly_name": "Off"}},
+        ]
+
+        with patch('app.hass.get_entities', AsyncMock(return_value=mock_entities)):
+            with patch('app.hass.HA_TOKEN', mock_config["hass_token"]):
+                summary = await summarize_domain("light", example_limit=2)
+
+        assert summary["total_count"] == 4
+        assert summary["state_distribution"] == {"on": 3, "off": 1}
+        assert [e["entity_id"] for e in summary["examples"]["on"]] == ["light.on_0", "light.on_1"]
+        assert summary["examples"]["off"] == [{"entity_id": "light.off", "friendly_name": "Off"}]
+        assert summary["common_attributes"] == [("friendly_name", 4), ("brightness", 3)]
+
     @pytest.mark.asyncio
     async def test_get_automations(self, mock_config):
         """Test getting automations from the states API."""
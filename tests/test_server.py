@@ -1,35 +1,49 @@
 import pytest
+import httpx
+import respx
 import json
-import asyncio
+from operator import attrgetter
 from unittest.mock import patch, MagicMock, AsyncMock
-import os
-import sys
 import uuid
 
-# Add the app directory to sys.path
-current_dir = os.path.dirname(os.path.abspath(__file__))
-parent_dir = os.path.dirname(current_dir)
-app_dir = os.path.join(parent_dir, "app")
-if app_dir not in sys.path:
-    sys.path.insert(0, app_dir)
+# conftest patches httpx.AsyncClient for every test; keep the real class for
+# tests that send requests through respx
+RealAsyncClient = httpx.AsyncClient
 
 class TestMCPServer:
     """Test the MCP server functionality."""
     
-    def test_server_version(self):
+    def test_server_version(self, server_mod):
         """Test that the server has a version attribute."""
-        # Import the server module directly without mocking
+        # The server module is imported directly without mocking
         # This ensures we're testing the actual code
-        from app.server import mcp
+        mcp = server_mod.mcp
         
         # All MCP servers should have a name, and it should be "Hass-MCP"
         assert hasattr(mcp, "name")
         assert mcp.name == "Hass-MCP"
 
-    def test_async_handler_decorator(self):
+    @pytest.mark.asyncio
+    async def test_lifespan_closes_client_after_last_session(self, server_mod):
+        """Test that the shared client is only closed when the last session ends."""
+        calls = []
+        with patch("app.server.cleanup_client", AsyncMock(side_effect=lambda: calls.append("cleanup"))) as mock_cleanup, \
+                patch("app.server.flush_reloads", AsyncMock(side_effect=lambda: calls.append("flush"))), \
+                patch("app.server.drain_background", AsyncMock(side_effect=lambda timeout: calls.append("drain"))):
+            async with server_mod.server_lifespan(server_mod.mcp):
+                async with server_mod.server_lifespan(server_mod.mcp):
+                    pass
+                # Another session is still open
+                mock_cleanup.assert_not_awaited()
+            mock_cleanup.assert_awaited_once()
+
+        # Background configures and pending reloads finish while the client is still open
+        assert calls == ["drain", "flush", "cleanup"]
+
+    @pytest.mark.asyncio
+    async def test_async_handler_decorator(self, server_mod):
         """Test the async_handler decorator."""
-        # Import the decorator
-        from app.server import async_handler
+        async_handler = server_mod.async_handler
         
         # Create a test async function
         async def test_func(arg1, arg2=None):
@@ -39,16 +53,13 @@ class TestMCPServer:
         decorated_func = async_handler("test_command")(test_func)
         
         # Run the decorated function
-        result = asyncio.run(decorated_func("val1", arg2="val2"))
+        result = await decorated_func("val1", arg2="val2")
         
         # Verify the result
         assert result == "val1_val2"
     
-    def test_tool_functions_exist(self):
+    def test_tool_functions_exist(self, server_mod):
         """Test that tool functions exist in the server module."""
-        # Import the server module directly
-        import app.server
-        
         # List of expected tool functions
         expected_tools = [
             "get_version",
@@ -61,16 +72,12 @@ class TestMCPServer:
             "list_automations"
         ]
         
-        # Check that each expected tool function exists
-        for tool_name in expected_tools:
-            assert hasattr(app.server, tool_name)
-            assert callable(getattr(app.server, tool_name))
+        # Look up all functions at once (raises AttributeError naming any missing one)
+        funcs = attrgetter(*expected_tools)(server_mod)
+        assert all(callable(f) for f in funcs)
     
-    def test_resource_functions_exist(self):
+    def test_resource_functions_exist(self, server_mod):
         """Test that resource functions exist in the server module."""
-        # Import the server module directly
-        import app.server
-        
         # List of expected resource functions - Use only the ones actually in server.py
         expected_resources = [
             "get_entity_resource", 
@@ -80,15 +87,14 @@ class TestMCPServer:
             "search_entities_resource_with_limit"  # Search resource with limit parameter
         ]
         
-        # Check that each expected resource function exists
-        for resource_name in expected_resources:
-            assert hasattr(app.server, resource_name)
-            assert callable(getattr(app.server, resource_name))
+        # Look up all functions at once (raises AttributeError naming any missing one)
+        funcs = attrgetter(*expected_resources)(server_mod)
+        assert all(callable(f) for f in funcs)
             
     @pytest.mark.asyncio
-    async def test_list_automations_error_handling(self):
+    async def test_list_automations_error_handling(self, server_mod):
         """Test that list_automations handles errors properly."""
-        from app.server import list_automations
+        list_automations = server_mod.list_automations
         
         # Mock the get_automations function with different scenarios
         with patch("app.server.get_automations") as mock_get_automations:
@@ -134,11 +140,8 @@ class TestMCPServer:
             assert len(result) == 1
             assert result[0]["id"] == "morning_lights"
             
-    def test_tools_have_proper_docstrings(self):
+    def test_tools_have_proper_docstrings(self, server_mod):
         """Test that tool functions have proper docstrings"""
-        # Import the server module directly
-        import app.server
-        
         # List of expected tool functions
         tool_functions = [
             "get_version",
@@ -155,17 +158,13 @@ class TestMCPServer:
         ]
         
         # Check that each tool function has a proper docstring and exists
-        for tool_name in tool_functions:
-            assert hasattr(app.server, tool_name), f"{tool_name} function missing"
-            tool_function = getattr(app.server, tool_name)
+        funcs = attrgetter(*tool_functions)(server_mod)
+        for tool_name, tool_function in zip(tool_functions, funcs):
             assert tool_function.__doc__ is not None, f"{tool_name} missing docstring"
             assert len(tool_function.__doc__.strip()) > 10, f"{tool_name} has insufficient docstring"
     
-    def test_prompt_functions_exist(self):
+    def test_prompt_functions_exist(self, server_mod):
         """Test that prompt functions exist in the server module."""
-        # Import the server module directly
-        import app.server
-        
         # List of expected prompt functions
         expected_prompts = [
             "create_automation",
@@ -173,15 +172,14 @@ class TestMCPServer:
             "troubleshoot_entity"
         ]
         
-        # Check that each expected prompt function exists
-        for prompt_name in expected_prompts:
-            assert hasattr(app.server, prompt_name)
-            assert callable(getattr(app.server, prompt_name))
+        # Look up all functions at once (raises AttributeError naming any missing one)
+        funcs = attrgetter(*expected_prompts)(server_mod)
+        assert all(callable(f) for f in funcs)
             
     @pytest.mark.asyncio
-    async def test_search_entities_resource(self):
+    async def test_search_entities_resource(self, server_mod):
         """Test the search_entities_tool function"""
-        from app.server import search_entities_tool
+        search_entities_tool = server_mod.search_entities_tool
         
         # Mock the get_entities function with test data
         mock_entities = [
@@ -224,11 +222,40 @@ class TestMCPServer:
             mock_get.reset_mock()
             result = await search_entities_tool(query="light", limit=10)
             mock_get.assert_called_once_with(search_query="light", limit=10, lean=True)
-            
+
+    @pytest.mark.asyncio
+    @respx.mock
+    async def test_search_entities_over_http(self, server_mod):
+        """Test search_entities_tool through the real httpx client, JSON decoding and cache"""
+        from app.hass import entity_cache
+        entity_cache.invalidate()
+
+        mock_entities = [
+            {"entity_id": "light.living_room", "state": "on", "attributes": {"friendly_name": "Living Room Light", "brightness": 255}},
+            {"entity_id": "switch.kitchen", "state": "off", "attributes": {"friendly_name": "Kitchen Switch"}}
+        ]
+        route = respx.get("http://localhost:8123/api/states").respond(200, json=mock_entities)
+
+        client = RealAsyncClient()
+        with patch("app.hass.get_client", AsyncMock(return_value=client)):
+            with patch("app.hass.HA_URL", "http://localhost:8123"), patch("app.hass.HA_TOKEN", "mock_token"):
+                result = await server_mod.search_entities_tool(query="living")
+
+                # Only the matching entity is returned, decoded from the HTTP response
+                assert result["count"] == 1
+                assert result["results"][0]["entity_id"] == "light.living_room"
+                assert result["results"][0]["brightness"] == 255
+
+                # The same search is answered from the entity cache
+                await server_mod.search_entities_tool(query="living")
+                assert route.call_count == 1
+        await client.aclose()
+        entity_cache.invalidate()
+
     @pytest.mark.asyncio
-    async def test_domain_summary_tool(self):
+    async def test_domain_summary_tool(self, server_mod):
         """Test the domain_summary_tool function"""
-        from app.server import domain_summary_tool
+        domain_summary_tool = server_mod.domain_summary_tool
         
         # Mock the summarize_domain function
         mock_summary = {
@@ -253,9 +280,9 @@ class TestMCPServer:
             assert result == mock_summary
             
     @pytest.mark.asyncio        
-    async def test_get_entity_with_field_filtering(self):
+    async def test_get_entity_with_field_filtering(self, server_mod):
         """Test the get_entity function with field filtering"""
-        from app.server import get_entity
+        get_entity = server_mod.get_entity
         
         # Mock entity data
         mock_entity = {
@@ -0,0 +1,260 @@
+import asyncio
+import pytest
+import httpx
+import orjson
+from unittest.mock import MagicMock, patch, AsyncMock
+
+import app.hass
+from app import simplified_extensions
+from app.simplified_extensions import (
+    configure_ha_component, configure_ha_components, delete_ha_component,
+    drain_background, flush_reloads, set_entity_attributes
+)
+
+# conftest patches httpx.AsyncClient for every test; keep the real class for
+# tests that run requests through a MockTransport
+RealAsyncClient = httpx.AsyncClient
+
+def make_response(status_code: int, **kwargs) -> httpx.Response:
+    """Create a real httpx response for a config API request."""
+    request = httpx.Request("POST", "http://localhost:8123/api/config/automation/config/test")
+    return httpx.Response(status_code, request=request, **kwargs)
+
+@pytest.fixture(autouse=True)
+def clear_config_cache():
+    """Start every test with an empty configure response cache."""
+    simplified_extensions.config_response_cache.invalidate()
+    yield
+    simplified_extensions.config_response_cache.invalidate()
+
+class TestSimplifiedExtensions:
+    """Test the component configuration helpers."""
+
+    @pytest.mark.asyncio
+    async def test_reloads_are_coalesced(self, mock_httpx_client):
+        """Test that several changes to one component type trigger a single reload."""
+        mock_httpx_client.post.return_value = make_response(200, json={"result": "ok"})
+        mock_httpx_client.delete.return_value = make_response(200)
+
+        with patch('app.simplified_extensions.get_client', AsyncMock(return_value=mock_httpx_client)):
+            with patch('app.simplified_extensions.call_service', AsyncMock(return_value={})) as mock_call:
+                await configure_ha_component("automation", "first", {"alias": "First"})
+                await configure_ha_component("automation", "second", {"alias": "Second"})
+                await delete_ha_component("automation", "third")
+                await configure_ha_component("script", "fourth", {"alias": "Fourth"})
+
+                # Nothing is reloaded until the debounce window has passed
+                mock_call.assert_not_called()
+
+                await flush_reloads()
+
+                # One reload per component type
+                assert mock_call.await_count == 2
+                reloaded = sorted(call.args[0] for call in mock_call.await_args_list)
+                assert reloaded == ["automation", "script"]
+                assert all(call.args[1:] == ("reload", {}) for call in mock_call.await_args_list)
+
+                assert not simplified_extensions._pending_reloads
+                assert not simplified_extensions._reload_tasks
+
+    @pytest.mark.asyncio
+    async def test_reload_is_not_postponed_forever(self):
+        """Test that a steady stream of changes still triggers a reload after the max wait."""
+        with patch.object(simplified_extensions, 'RELOAD_DEBOUNCE_SECONDS', 0.05), \
+                patch.object(simplified_extensions, 'RELOAD_MAX_WAIT_SECONDS', 0.15):
+            with patch('app.simplified_extensions.call_service', AsyncMock(return_value={})) as mock_call:
+                # A change every 20 ms would keep a pure trailing debounce from ever firing
+                for _ in range(15):
+                    simplified_extensions._schedule_reload("automation")
+                    await asyncio.sleep(0.02)
+
+                assert mock_call.await_count >= 1
+                await flush_reloads()
+                assert not simplified_extensions._reload_deadlines
+
+    @pytest.mark.asyncio
+    async def test_set_entity_attributes_service_selection(self):
+        """Test that set_entity_attributes picks the service from domain and attributes."""
+        cases = [
+            ("light.living_room", {"brightness": 150}, "turn_on"),
+            ("switch.kitchen", {}, "turn_on"),
+            ("climate.office", {"hvac_mode": "cool", "temperature": 21.0}, "set_temperature"),
+            ("climate.office", {"hvac_mode": "cool"}, "set_hvac_mode"),
+            ("climate.office", {}, "turn_on"),
+            ("cover.garage", {"tilt_position": 40}, "set_cover_tilt_position"),
+            ("cover.garage", {}, "open_cover"),
+            ("fan.bedroom", {"oscillating": True}, "oscillate"),
+            ("media_player.tv", {"source": "HDMI 1"}, "select_source"),
+            ("media_player.tv", {}, "media_play"),
+            ("vacuum.robot", {"fan_speed": "max"}, "turn_on"),
+        ]
+
+        with patch('app.simplified_extensions.call_service', AsyncMock(return_value={})) as mock_call:
+            for entity_id, attributes, expected_service in cases:
+                mock_call.reset_mock()
+                await set_entity_attributes(entity_id, attributes)
+
+                domain, service, data = mock_call.await_args.args
+                assert domain == entity_id.split(".")[0]
+                assert service == expected_service, entity_id
+                assert data == {"entity_id": entity_id, **attributes}
+
+    @pytest.mark.asyncio
+    async def test_identical_configure_calls_are_cached(self, mock_httpx_client):
+        """Test that identical retries are served from cache until the component is deleted."""
+        mock_httpx_client.post.return_value = make_response(200, json={"result": "ok"})
+        mock_httpx_client.delete.return_value = make_response(200)
+        config = {"alias": "Retry", "trigger": [], "action": []}
+
+        with patch('app.simplified_extensions.get_client', AsyncMock(return_value=mock_httpx_client)):
+            with patch('app.simplified_extensions.call_service', AsyncMock(return_value={})):
+                first = await configure_ha_component("automation", "retry", config)
+                second = await configure_ha_component("automation", "retry", dict(reversed(config.items())))
+                assert first == second == {"result": "ok"}
+                assert mock_httpx_client.post.await_count == 1
+
+                # Different data is not served from cache
+                await configure_ha_component("automation", "retry", {**config, "alias": "Changed"})
+                assert mock_httpx_client.post.await_count == 2
+
+                # Switching back (A -> B -> A) must write A again
+                await configure_ha_component("automation", "retry", config)
+                assert mock_httpx_client.post.await_count == 3
+                sent = orjson.loads(mock_httpx_client.post.await_args.kwargs["content"])
+                assert sent["alias"] == "Retry"
+
+                # Deleting the component invalidates its cached responses
+                await delete_ha_component("automation", "retry")
+                await configure_ha_component("automation", "retry", config)
+                assert mock_httpx_client.post.await_count == 4
+
+                await flush_reloads()
+
+    @pytest.mark.asyncio
+    async def test_configure_http_error_message(self, mock_httpx_client):
+        """Test that HTTP errors are reported with the message from the response body."""
+        json_error = make_response(400, json={"message": "Message malformed"})
+        text_error = make_response(404, text="Not found")
+
+        with patch('app.simplified_extensions.get_client', AsyncMock(return_value=mock_httpx_client)):
+            mock_httpx_client.post.return_value = json_error
+            result = await configure_ha_component("automation", "broken", {"alias": "Broken"})
+            assert result == {"error": "HTTP error 400 - Bad Request: Message malformed"}
+
+            mock_httpx_client.delete.return_value = text_error
+            result = await delete_ha_component("automation", "broken")
+            assert result == {"error": "HTTP error 404 - Not Found: Not found"}
+
+            mock_httpx_client.delete.return_value = make_response(500)
+            result = await delete_ha_component("automation", "broken")
+            assert result == {"error": "HTTP error 500 - Internal Server Error"}
+
+            # Redirects (e.g. http -> https proxy) are not followed and are no success
+            redirect = make_response(301, headers={"Location": "https://ha.example/api/config/automation/config/broken"})
+            mock_httpx_client.post.return_value = redirect
+            result = await configure_ha_component("automation", "broken", {"alias": "Broken"})
+            assert result == {"error": "HTTP error 301 - Moved Permanently"}
+            mock_httpx_client.delete.return_value = redirect
+            result = await delete_ha_component("automation", "broken")
+            assert result == {"error": "HTTP error 301 - Moved Permanently"}
+
+    @pytest.mark.asyncio
+    async def test_configure_ha_components_batch(self, mock_httpx_client):
+        """Test that a batch configures every item and reloads each changed type once."""
+        async def post(url, **kwargs):
+            if "/script/" in url:
+                return make_response(400, json={"message": "Message malformed"})
+            return make_response(200, json={"result": "ok"})
+
+        mock_httpx_client.post.side_effect = post
+        items = [
+            {"component_type": "automation", "object_id": f"auto_{i}", "config_data": {"alias": f"Auto {i}"}}
+            for i in range(5)
+        ] + [
+            {"component_type": "input_boolean", "object_id": "flag", "config_data": {"name": "Flag"}},
+            # Unknown keys such as eager are ignored, the request is still awaited
+            {"component_type": "automation", "object_id": "eager", "config_data": {"alias": "Eager"}, "eager": True},
+            # Every script fails, so scripts are not reloaded
+            {"component_type": "script", "object_id": "broken", "config_data": {"alias": "Broken"}},
+        ]
+
+        with patch('app.simplified_extensions.get_client', AsyncMock(return_value=mock_httpx_client)):
+            with patch('app.simplified_extensions.call_service', AsyncMock(return_value={})) as mock_call:
+                results = await configure_ha_components(items, concurrency=2)
+
+                assert results[:-1] == [{"result": "ok"}] * (len(items) - 1)
+                assert results[-1] == {"error": "HTTP error 400 - Bad Request: Message malformed"}
+                assert mock_httpx_client.post.await_count == len(items)
+                assert not simplified_extensions._background
+
+                # Only reloadable types that changed, and only once, without leftover debounced reloads
+                mock_call.assert_awaited_once_with("automation", "reload", {})
+                assert not simplified_extensions._pending_reloads
+
+    @pytest.mark.asyncio
+    async def test_configure_ha_components_rejects_invalid_concurrency(self):
+        """Test that a batch without any allowed concurrent request fails instead of hanging."""
+        items = [{"component_type": "automation", "object_id": "auto", "config_data": {"alias": "Auto"}}]
+        for concurrency in (0, -1):
+            with pytest.raises(ValueError, match="concurrency must be >= 1"):
+                await asyncio.wait_for(configure_ha_components(items, concurrency=concurrency), 1)
+
+    @pytest.mark.asyncio
+    async def test_configure_without_json_body(self, mock_httpx_client):
+        """Test that empty or non-JSON success bodies yield a generic success message."""
+        with patch('app.simplified_extensions.get_client', AsyncMock(return_value=mock_httpx_client)):
+            with patch('app.simplified_extensions.call_service', AsyncMock(return_value={})):
+                mock_httpx_client.post.return_value = make_response(200)
+                result = await configure_ha_component("input_boolean", "empty", {"name": "Empty"})
+                assert result == {"result": "success", "message": "input_boolean empty created successfully."}
+
+                mock_httpx_client.post.return_value = make_response(200, text="OK")
+                result = await configure_ha_component("input_boolean", "text", {"name": "Text"}, update=True)
+                assert result == {"result": "success", "message": "input_boolean text updated successfully."}
+
+    @pytest.mark.asyncio
+    async def test_configure_eager_returns_immediately(self, mock_httpx_client):
+        """Test that eager mode schedules the request and returns without waiting."""
+        mock_httpx_client.post.return_value = make_response(200, json={"result": "ok"})
+
+        with patch('app.simplified_extensions.get_client', AsyncMock(return_value=mock_httpx_client)):
+            with patch('app.simplified_extensions.call_service', AsyncMock(return_value={})):
+                result = await configure_ha_component("script", "eager", {"alias": "Eager"}, eager=True)
+                assert result["result"] == "scheduled"
+                mock_httpx_client.post.assert_not_called()
+
+                await drain_background(timeout=1)
+                mock_httpx_client.post.assert_awaited_once()
+                assert not simplified_extensions._background
+
+                await flush_reloads()
+
+    @pytest.mark.asyncio
+    async def test_requests_survive_client_cleanup(self):
+        """Test that configure/delete use the current shared client, also after cleanup_client()."""
+        seen = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            seen.append(request)
+            return httpx.Response(200, json={"result": "ok"})
+
+        def make_client(**kwargs):
+            return RealAsyncClient(transport=httpx.MockTransport(handler), **kwargs)
+
+        with patch.object(app.hass, '_client', None), patch('httpx.AsyncClient', side_effect=make_client):
+            with patch('app.config.HA_TOKEN', 'test_token'):
+                with patch('app.simplified_extensions.call_service', AsyncMock(return_value={})):
+                    result = await configure_ha_component("input_boolean", "direct", {"name": "Direct"})
+                    assert result == {"result": "ok"}
+
+                    # The lifespan closes the client; the next call must get a new one
+                    await app.hass.cleanup_client()
+                    result = await delete_ha_component("input_boolean", "direct")
+                    assert result == {"result": "success", "message": "input_boolean direct gelöscht"}
+            await app.hass.cleanup_client()
+
+        assert [r.method for r in seen] == ["POST", "DELETE"]
+        for request in seen:
+            assert request.url.path == "/api/config/input_boolean/config/direct"
+            assert request.headers["Authorization"] == "Bearer test_token"
+            assert request.headers["Content-Type"] == "application/json"